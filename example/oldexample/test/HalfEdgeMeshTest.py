@@ -7,6 +7,18 @@ import time
 from fealpy.mesh import HalfEdgeMesh,Quadtree
 from fealpy.mesh import TriangleMesh, PolygonMesh, QuadrangleMesh
 
+# voronoi_test 中单位正方形的节点和半边, 在导入时生成一次
+_NODE_TEMPLATE = np.array([
+    (0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 1.0)], dtype=np.float64)
+_HE_TEMPLATE = np.array([
+    (1, 0, 1, 3, 4, 1),
+    (2, 0, 2, 0, 5, 1),
+    (3, 0, 3, 1, 6, 1),
+    (0, 0, 0, 2, 7, 1),
+    (0, 1, 7, 5, 0, 0),
+    (1, 1, 4, 6, 1, 0),
+    (2, 1, 5, 7, 2, 0),
+    (3, 1, 6, 4, 3, 0)], dtype=np.int32)
 
 class HalfEdgeMeshTest:
     def __init__(self):
@@ -16,10 +28,10 @@ class HalfEdgeMeshTest:
         node = np.array([
             (0.0, 0.0), (0.0, 1.0), (0.0, 2.0),
             (1.0, 0.0), (1.0, 1.0), (1.0, 2.0),
-            (2.0, 0.0), (2.0, 1.0), (2.0, 2.0)], dtype=np.float)
+            (2.0, 0.0), (2.0, 1.0), (2.0, 2.0)], dtype=np.float64)
         cell = np.array([0, 3, 4, 4, 1, 0,
-            1, 4, 5, 2, 3, 6, 7, 4, 4, 7, 8, 5], dtype=np.int)
-        cellLocation = np.array([0, 3, 6, 10, 14, 18], dtype=np.int)
+            1, 4, 5, 2, 3, 6, 7, 4, 4, 7, 8, 5], dtype=np.int32)
+        cellLocation = np.array([0, 3, 6, 10, 14, 18], dtype=np.int32)
 
         mesh = PolygonMesh(node, cell, cellLocation)
         mesh = HalfEdgeMesh.from_mesh(mesh)
@@ -62,12 +74,15 @@ class HalfEdgeMeshTest:
  
 
         #print("halfedge level:\n")
-        #for i, val in enumerate(mesh.halfedgedata['level']):
-        #    print(i, ':', val, mesh.ds.halfedge[i, 0:2])
+        #halfedge = mesh.ds.halfedge
+        #hlevel = mesh.halfedgedata['level']
+        #np.savetxt(sys.stdout, np.column_stack((np.arange(len(hlevel)),
+        #    hlevel, halfedge[:, 0:2])), fmt='%d')
 
         #print("cell level:\n")
-        #for i, val in enumerate(mesh.celldata['level']):
-        #    print(i, ':', val)
+        #clevel = mesh.celldata['level']
+        #np.savetxt(sys.stdout, np.column_stack((np.arange(len(clevel)),
+        #    clevel)), fmt='%d')
 
         if plot:
 
@@ -87,7 +102,7 @@ class HalfEdgeMeshTest:
             mesh.find_cell(axes, showindex=True, multiindex=cindex)
 
             NN = mesh.number_of_nodes()
-            nindex = np.zeros(NN, dtype=np.int)
+            nindex = np.zeros(NN, dtype=np.int32)
             halfedge = mesh.ds.halfedge
             nindex[halfedge[:, 0]] = mesh.get_data('halfedge', 'level')
             cindex = mesh.get_data('cell', 'level')
@@ -140,7 +155,7 @@ class HalfEdgeMeshTest:
             mesh.find_cell(axes, showindex=True, multiindex=cindex)
 
             NN = mesh.number_of_nodes()
-            nindex = np.zeros(NN, dtype=np.int)
+            nindex = np.zeros(NN, dtype=np.int32)
             halfedge = mesh.ds.halfedge
             nindex[halfedge[:, 0]] = mesh.get_data('halfedge', 'level')
             cindex = mesh.get_data('cell', 'level')
@@ -159,10 +174,10 @@ class HalfEdgeMeshTest:
         node = np.array([
             (0.0, 0.0), (0.0, 1.0), (0.0, 2.0),
             (1.0, 0.0), (1.0, 1.0), (1.0, 2.0),
-            (2.0, 0.0), (2.0, 1.0), (2.0, 2.0)], dtype=np.float)
+            (2.0, 0.0), (2.0, 1.0), (2.0, 2.0)], dtype=np.float64)
         cell = np.array([0, 3, 4, 4, 1, 0,
-            1, 4, 5, 2, 3, 6, 7, 4, 4, 7, 8, 5], dtype=np.int)
-        cellLocation = np.array([0, 3, 6, 10, 14, 18], dtype=np.int)
+            1, 4, 5, 2, 3, 6, 7, 4, 4, 7, 8, 5], dtype=np.int32)
+        cellLocation = np.array([0, 3, 6, 10, 14, 18], dtype=np.int32)
 
         mesh = PolygonMesh(node, cell, cellLocation)
         mesh = HalfEdgeMesh.from_mesh(mesh)
@@ -225,7 +240,7 @@ class HalfEdgeMeshTest:
             mesh.find_cell(axes, showindex=True, multiindex=cindex)
 
             NN = mesh.number_of_nodes()
-            nindex = np.zeros(NN, dtype=np.int)
+            nindex = np.zeros(NN, dtype=np.int32)
             halfedge = mesh.ds.halfedge
             nindex[halfedge[:, 0]] = mesh.get_data('halfedge', 'level')
             cindex = mesh.get_data('cell', 'level')
@@ -253,8 +268,8 @@ class HalfEdgeMeshTest:
         mesh = HalfEdgeMesh.from_mesh(tmesh)
         if plot:
             halfedge = mesh.ds.halfedge
-            for i, idx in enumerate(halfedge):
-                print(i, ": " , idx)
+            NHE = len(halfedge)
+            np.savetxt(sys.stdout, np.column_stack((np.arange(NHE), halfedge)), fmt='%d')
 
             fig = plt.figure()
             axes = fig.gca()
@@ -281,8 +296,8 @@ class HalfEdgeMeshTest:
         mesh = HalfEdgeMesh.from_mesh(tmesh)
         if plot:
             halfedge = mesh.ds.halfedge
-            for i, idx in enumerate(halfedge):
-                print(i, ": " , idx)
+            NHE = len(halfedge)
+            np.savetxt(sys.stdout, np.column_stack((np.arange(NHE), halfedge)), fmt='%d')
 
             fig = plt.figure()
             axes = fig.gca()
@@ -298,8 +313,8 @@ class HalfEdgeMeshTest:
             plt.show()
 
     def refine_quad(self, plot=True):
-        cell = np.array([[0,1,2,3],[1,4,5,2]],dtype = np.int)
-        node = np.array([[0,0],[1,0],[1,1],[0,1],[2,0],[2,1]], dtype = np.float)
+        cell = np.array([[0,1,2,3],[1,4,5,2]],dtype = np.int32)
+        node = np.array([[0,0],[1,0],[1,1],[0,1],[2,0],[2,1]], dtype = np.float64)
         mesh = QuadrangleMesh(node, cell)
         #mesh.uniform_refine()
         mesh = HalfEdgeMesh.from_mesh(mesh)
@@ -352,7 +367,7 @@ class HalfEdgeMeshTest:
             mesh.find_cell(axes, showindex=True, multiindex=cindex)
 
             NN = mesh.number_of_nodes()
-            nindex = np.zeros(NN, dtype=np.int)
+            nindex = np.zeros(NN, dtype=np.int32)
             halfedge = mesh.ds.halfedge
             nindex = mesh.nodedata['level']
             cindex = mesh.get_data('cell', 'level')
@@ -364,8 +379,8 @@ class HalfEdgeMeshTest:
             plt.show()
 
     def quadtree_test(self, plot=True):
-        cell = np.array([[0,1,2,3],[1,4,5,2]],dtype = np.int)
-        node = np.array([[0,0],[1,0],[1,1],[0,1],[2,0],[2,1]], dtype = np.float)
+        cell = np.array([[0,1,2,3],[1,4,5,2]],dtype = np.int32)
+        node = np.array([[0,0],[1,0],[1,1],[0,1],[2,0],[2,1]], dtype = np.float64)
         mesh = Quadtree(node, cell)
         pmesh = mesh.to_pmesh()
 
@@ -393,7 +408,7 @@ class HalfEdgeMeshTest:
         plt.show()
         print('refine:', aopts['HB'])
 
-        eta = np.zeros(20,np.int)
+        eta = np.zeros(20, dtype=np.int32)
         eta[4] = -1
         eta[5] = -1
         eta[6] = -1
@@ -411,13 +426,14 @@ class HalfEdgeMeshTest:
         plt.show()
 
 
-    def voronoi_test(self, plot=False):
+    def voronoi_test(self, plot=False, verbose=True):
         from scipy.spatial import Delaunay
         from scipy.spatial import Voronoi, voronoi_plot_2d
-        from scipy.spatial import KDTree
+        from scipy.spatial import cKDTree as KDTree
 
         points = np.random.rand(10, 2)
-        print(points)
+        if verbose:
+            print(points)
 
         # 边界点固定标记, 在网格生成与自适应算法中不能移除
         # 1: 固定
@@ -430,39 +446,32 @@ class HalfEdgeMeshTest:
         #  n: n >= 1, 表示编号为  n 的内部子区域
         dflag = np.array([1, 0])
 
-        node = np.array([
-            (0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 1.0)], dtype=np.float)
-        halfedge = np.array([
-            (1, 0, 1, 3, 4, 1),
-            (2, 0, 2, 0, 5, 1),
-            (3, 0, 3, 1, 6, 1),
-            (0, 0, 0, 2, 7, 1),
-            (0, 1, 7, 5, 0, 0),
-            (1, 1, 4, 6, 1, 0),
-            (2, 1, 5, 7, 2, 0),
-            (3, 1, 6, 4, 3, 0)], dtype=np.int)
+        node = _NODE_TEMPLATE.copy()
+        halfedge = _HE_TEMPLATE.copy()
         NC = 1
         mesh = HalfEdgeMesh(node, halfedge, NC)
         mesh.set_data('fflag', fflag, 'node')
         mesh.set_data('dflag', dflag, 'cell')
 
-        v = Voronoi(points)
+        v = Voronoi(points, qhull_options='Qbb Qc Qz')
         tree = KDTree(points)
 
-        print("points:\n", v.points)
-        print('vertices:\n', v.vertices)
-        print('ridge_points:\n', v.ridge_points)
-        print('ridge_vertices:\n', v.ridge_vertices)
-        print('regions:\n', v.regions)
-        print('point_region:\n', v.point_region)
+        if verbose:
+            print("points:\n", v.points)
+            print('vertices:\n', v.vertices)
+            print('ridge_points:\n', v.ridge_points)
+            print('ridge_vertices:\n', v.ridge_vertices)
+            print('regions:\n', v.regions)
+            print('point_region:\n', v.point_region)
 
         d, nidx = tree.query(node)
-        print(nidx)
+        if verbose:
+            print(nidx)
 
         if plot:
             halfedge = mesh.ds.halfedge
-            for i, idx in enumerate(halfedge):
-                print(i, ": " , idx)
+            NHE = len(halfedge)
+            np.savetxt(sys.stdout, np.column_stack((np.arange(NHE), halfedge)), fmt='%d')
 
             fig = plt.figure()
             axes = fig.gca()
@@ -481,8 +490,8 @@ class HalfEdgeMeshTest:
 
 
     def refine_triangle_rbTest(self, l, plot=True, rb=True):
-        cell = np.array([[0,1,2],[0,2,3],[1,4,5],[2,1,5]],dtype = np.int)
-        node = np.array([[0,0],[1,0],[1,1],[0,1],[2,0],[2,1]], dtype = np.float)
+        cell = np.array([[0,1,2],[0,2,3],[1,4,5],[2,1,5]],dtype = np.int32)
+        node = np.array([[0,0],[1,0],[1,1],[0,1],[2,0],[2,1]], dtype = np.float64)
         mesh = TriangleMesh(node, cell)
         #mesh.uniform_refine()
         mesh = HalfEdgeMesh.from_mesh(mesh)
@@ -543,7 +552,7 @@ class HalfEdgeMeshTest:
             mesh.find_cell(axes, showindex=True, multiindex=cindex)
 
             NN = mesh.number_of_nodes()
-            nindex = np.zeros(NN, dtype=np.int)
+            nindex = np.zeros(NN, dtype=np.int32)
             halfedge = mesh.ds.halfedge
             nindex = mesh.nodedata['level']
             cindex = mesh.get_data('cell', 'level')
@@ -1,11 +1,79 @@
 import numpy as np
 import time
 from scipy.sparse import coo_matrix, csc_matrix, csr_matrix, spdiags, eye, tril, triu
-from ..quadrature import TriangleQuadrature, QuadrangleQuadrature, GaussLegendreQuadrature 
-from .Mesh2d import Mesh2d
-from .adaptive_tools import mark
-from .mesh_tools import show_halfedge_mesh
-from ..common.Tools import hash2map
+from ....quadrature import TriangleQuadrature, QuadrangleQuadrature, GaussLegendreQuadrature 
+from ..Mesh2d import Mesh2d
+from ...adaptive_tools import mark
+from ...mesh_tools import show_halfedge_mesh
+from ....common.Tools import hash2map
+from .halfedge_kernels import njit, prange, walk_cells
+
+
+@njit(parallel=True, cache=True)
+def _split_cells(pre, isSplit, cell, idx0, idx1):
+    """
+
+    Notes
+    -----
+    从每条细分半边 idx0[i] 出发, 沿着前一条半边 pre 往回走, 直到前一条半边
+    也是细分半边 (isSplit 为 True) 为止. 路过的半边都归入 idx0[i] 所在的新
+    单元 cell[idx0[i]], 停下来的半边编号写入 idx1[i].
+    """
+    for i in prange(len(idx0)):
+        h = idx0[i]
+        c = cell[h]
+        while not isSplit[pre[h]]:
+            h = pre[h]
+            cell[h] = c
+        idx1[i] = h
+
+@njit(parallel=True, cache=True)
+def _edge_midvalue(val, v0, v1, out):
+    """
+
+    Notes
+    -----
+    计算以 v0[i], v1[i] 为端点的边上的中点值 out[i] = (val[v0[i]] + val[v1[i]])/2,
+    val 和 out 的每一行是一个节点或一条边上的所有分量.
+    """
+    for i in prange(len(v0)):
+        for k in range(val.shape[1]):
+            out[i, k] = 0.5*(val[v0[i], k] + val[v1[i], k])
+
+@njit(parallel=True, cache=True)
+def _quad_blue_hedge(he_v, he_n, he_p, he_o, nlevel, out):
+    """
+
+    Notes
+    -----
+    一次遍历半边, 标记四边形网格中蓝色半边的对偶半边: 半边指向的节点层数
+    大于对偶半边指向的节点层数, 且与下一条半边和其后两条对偶路径上半边指向
+    的节点层数都相同.
+    """
+    for i in prange(len(he_v)):
+        l = nlevel[he_v[i]]
+        o = he_o[i]
+        t0 = he_o[he_p[o]]
+        t1 = he_o[he_p[t0]]
+        out[i] = ((l > nlevel[he_v[o]]) and (l == nlevel[he_v[he_n[i]]])
+                and (l == nlevel[he_v[t0]]) and (l == nlevel[he_v[t1]]))
+
+@njit(parallel=True, cache=True)
+def _tri_blue_hedge(he_v, he_c, he_n, he_p, he_o, nlevel, out):
+    """
+
+    Notes
+    -----
+    一次遍历半边, 标记三角形网格中的蓝色半边: 两侧单元都是内部单元, 且半边
+    指向的节点层数大于对偶半边, 下一条半边和对偶路径上半边指向的节点层数.
+    """
+    for i in prange(len(he_v)):
+        l = nlevel[he_v[i]]
+        o = he_o[i]
+        t0 = he_o[he_p[o]]
+        out[i] = ((he_c[i] > 0) and (he_c[o] > 0)
+                and (l > nlevel[he_v[o]]) and (l > nlevel[he_v[he_n[i]]])
+                and (l > nlevel[he_v[t0]]))
 
 
 # subdomain: 单元所处的子区域的标记编号
@@ -30,6 +98,12 @@ class HalfEdgeMesh(Mesh2d):
         subdomain : (NC, ) the sub domain flag of each cell blong to
         """
 
+        # 半边数组中存的都是编号, 规模不大时用 int32 存储, 按列遍历半边时
+        # 读取的数据量减少一半
+        if (halfedge.dtype == np.int64 and
+                len(halfedge) + len(subdomain) + node.shape[0] < 2**31):
+            halfedge = halfedge.astype(np.int32)
+
         self.itype = halfedge.dtype
         self.ftype = node.dtype
 
@@ -51,6 +125,9 @@ class HalfEdgeMesh(Mesh2d):
         # 2: 区域内部的点
         self.nodedata['dof'] = nodedof
 
+        # 单元标记数组的缓冲区, 见 mark_buffer
+        self._mark_scratch = np.empty(0, dtype=np.bool_)
+
         self.init_level_info()
 
 
@@ -59,9 +136,10 @@ class HalfEdgeMesh(Mesh2d):
         NE = self.number_of_edges()
 
         NC = self.number_of_all_cells() # 实际单元个数
-        self.celldata['level'] = np.zeros(NC, dtype=self.itype)
-        self.halfedgedata['level'] = np.zeros(2*NE, dtype=self.itype)
-        self.nodedata['level'] = np.zeros(NN, dtype=self.itype)
+        # 加密层数都是很小的整数, 用 int8 存储
+        self.celldata['level'] = np.zeros(NC, dtype=np.int8)
+        self.halfedgedata['level'] = np.zeros(2*NE, dtype=np.int8)
+        self.nodedata['level'] = np.zeros(NN, dtype=np.int8)
 
     def number_of_all_cells(self):
         return self.ds.number_of_all_cells()
@@ -124,14 +202,14 @@ class HalfEdgeMesh(Mesh2d):
             halfedge[0::2, 1][isInEdge] = edge2cell[isInEdge, 1] + 1
             halfedge[1::2, 1] = edge2cell[:, 0] + 1
 
-            halfedge[0::2, 4] = range(1, 2*NE, 2)
-            halfedge[1::2, 4] = range(0, 2*NE, 2)
+            # 一对相反的半边相邻存储, 半边 h 的对偶半边就是 h^1
+            halfedge[:, 4] = np.bitwise_xor(np.arange(2*NE, dtype=halfedge.dtype), 1)
             halfedge[1::2, 5]  = 1
 
             NHE = len(halfedge)
             edge = np.zeros((2*NHE, 2), dtype=halfedge.dtype)
             edge[:NHE] = halfedge[:, 0:2]
-            edge[NHE:, 0] = halfedge[halfedge[:, 4], 0]
+            edge[NHE:, 0] = halfedge[:, 0].reshape(-1, 2)[:, ::-1].flat # 对偶半边指向的顶点
             edge[NHE:, 1] = halfedge[:, 1]
             idx = np.lexsort((edge[:, 0], edge[:, 1])).reshape(-1, 2)
             idx[:, 1] -= NHE
@@ -166,9 +244,16 @@ class HalfEdgeMesh(Mesh2d):
         node = self.node
         dim = self.geo_dimension()
         if etype in {'cell', 2}:
-            cell2node = self.ds.cell_to_node(return_sparse=True)
-            NV = self.ds.number_of_vertices_of_cells().reshape(-1,1)
-            bc = cell2node*node/NV
+            # 只对内部单元的半边按单元求和, 不再生成稀疏的 cell2node 矩阵
+            ds = self.ds
+            NC = ds.NC
+            cidx = ds.cidxmap[ds.he_c[ds.hflag]]
+            nidx = ds.he_v[ds.hflag]
+            NV = np.reshape(ds.number_of_vertices_of_cells(), (-1, 1))
+            bc = np.zeros((NC, dim), dtype=self.ftype)
+            for i in range(dim):
+                bc[:, i] = np.bincount(cidx, weights=node[nidx, i], minlength=NC)
+            bc /= NV
         elif etype in {'edge', 'face', 1}:
             edge = self.ds.edge_to_node()
             bc = np.sum(node[edge, :], axis=1).reshape(-1, dim)/edge.shape[1]
@@ -178,74 +263,62 @@ class HalfEdgeMesh(Mesh2d):
 
     def node_normal(self):
         node = self.node
-        cell, cellLocation = self.entity('cell') # TODO: for tri and quad case
-        idx1 = np.zeros(cell.shape[0], dtype=np.int)
-        idx2 = np.zeros(cell.shape[0], dtype=np.int)
-
-        idx1[0:-1] = cell[1:]
-        idx1[cellLocation[1:]-1] = cell[cellLocation[:-1]]
-        idx2[1:] = cell[0:-1]
-        idx2[cellLocation[:-1]] = cell[cellLocation[1:]-1]
-        w = np.array([(0,-1),(1,0)])
+        ds = self.ds
+        # 单元中每个顶点的前后两个顶点直接由半边的下一个和前一个半边得到
+        cell2hedge, _ = ds.cell_to_halfedge()
+        idx1 = ds.he_v[ds.he_n[cell2hedge]]
+        idx2 = ds.he_v[ds.he_p[cell2hedge]]
         d = node[idx1] - node[idx2]
-        return 0.5*d@w
-
-    def cell_area(self, index=None):
-        NC = self.number_of_cells()
-        node = self.entity('node')
-        halfedge = self.ds.halfedge
-        hflag = self.ds.hflag
-        cidxmap = self.ds.cidxmap
+        n = np.zeros_like(d)
+        n[:, 0] = 0.5*d[:, 1]
+        n[:, 1] = -0.5*d[:, 0]
+        return n
 
-        e0 = halfedge[halfedge[hflag, 3], 0]
-        e1 = halfedge[hflag, 0]
-
-        w = np.array([[0, -1], [1, 0]], dtype=np.int)
-        v= (node[e1] - node[e0])@w
-        val = np.sum(v*node[e0], axis=1)
+    def _cell_geometry(self, return_all=False, barycenter=True):
+        """
 
-        a = np.zeros(NC, dtype=self.ftype)
-        np.add.at(a, cidxmap[halfedge[hflag, 1]], val)
-        a /=2
-        return a
+        Notes
+        -----
+            一次遍历半边, 同时计算单元的面积和重心. 两者共用鞋带公式中的
+            有向面积项 val = x0*y1 - x1*y0, 再用 np.bincount 按单元求和.
 
-    def cell_barycenter(self, return_all=False):
-        GD = self.geo_dimension()
+            return_all 为 True 时计算所有单元 (包括外部区域和洞), 否则只计算
+            内部单元. barycenter 为 False 时只返回面积, 重心部分返回 None.
+        """
         node = self.entity('node')
-        halfedge = self.ds.halfedge
+        ds = self.ds
         if return_all:
             NC = self.number_of_all_cells()
-            e0 = halfedge[halfedge[:, 3], 0]
-            e1 = halfedge[:, 0]
-            w = np.array([[0, -1], [1, 0]], dtype=np.int)
-            v= (node[e1] - node[e0])@w
-            val = np.sum(v*node[e0], axis=1)
-            ec = val.reshape(-1, 1)*(node[e1]+node[e0])/2
-
-            a = np.zeros(NC, dtype=self.ftype)
-            c = np.zeros((NC, GD), dtype=self.ftype)
-            np.add.at(a, halfedge[:, 1], val)
-            np.add.at(c, (halfedge[:, 1], np.s_[:]), ec)
-            a /=2
-            c /=3*a.reshape(-1, 1)
-            return c
+            flag = np.s_[:]
+            cidx = ds.he_c
         else:
             NC = self.number_of_cells()
-            hflag = self.ds.hflag
-            cidxmap = self.ds.cidxmap
-            e0 = halfedge[halfedge[hflag, 3], 0]
-            e1 = halfedge[hflag, 0]
-            w = np.array([[0, -1], [1, 0]], dtype=np.int)
-            v= (node[e1] - node[e0])@w
-            val = np.sum(v*node[e0], axis=1)
-            ec = val.reshape(-1, 1)*(node[e1]+node[e0])/2
-            a = np.zeros(NC, dtype=self.ftype)
-            c = np.zeros((NC, GD), dtype=self.ftype)
-            np.add.at(a, cidxmap[halfedge[hflag, 1]], val)
-            np.add.at(c, (cidxmap[halfedge[hflag, 1]], np.s_[:]), ec)
-            a /=2
-            c /=3*a.reshape(-1, 1)
-            return c
+            flag = ds.hflag
+            cidx = ds.cidxmap[ds.he_c[flag]]
+
+        e0 = ds.he_v[ds.he_p[flag]]
+        e1 = ds.he_v[flag]
+        x0, y0 = node[e0, 0], node[e0, 1]
+        x1, y1 = node[e1, 0], node[e1, 1]
+        val = x0*y1 - x1*y0
+
+        a = np.bincount(cidx, weights=val, minlength=NC)
+        if not barycenter:
+            return a/2, None
+
+        c = np.zeros((NC, 2), dtype=self.ftype)
+        c[:, 0] = np.bincount(cidx, weights=val*(x0 + x1), minlength=NC)
+        c[:, 1] = np.bincount(cidx, weights=val*(y0 + y1), minlength=NC)
+        c /= 3*a.reshape(-1, 1)
+        return a/2, c
+
+    def cell_area(self, index=None):
+        a, _ = self._cell_geometry(barycenter=False)
+        return a
+
+    def cell_barycenter(self, return_all=False):
+        _, c = self._cell_geometry(return_all=return_all)
+        return c
 
     def edge_bc_to_point(self, bcs, index=None):
         node = self.entity('node')
@@ -258,7 +331,7 @@ class HalfEdgeMesh(Mesh2d):
         clevel = self.celldata['level'] # 注意这里是所有的单元的层信息
         nlevel = self.nodedata['level']
         halfedge = self.ds.halfedge
-        isMainHEdge = (halfedge[:, 5] == 1) # 主半边标记
+        isMainHEdge = self.ds.he_main # 主半边标记
         if method == 'poly':
             # 当前半边的层标记小于等于所属单元的层标记
             flag0 = (nlevel[halfedge[:, 0]] - clevel[halfedge[:, 1]]) <= 0 
@@ -283,7 +356,7 @@ class HalfEdgeMesh(Mesh2d):
         nlevel = self.nodedata['level']
         clevel = self.celldata['level']
 
-        isMainHEdge = (halfedge[:, 5] == 1)
+        isMainHEdge = self.ds.he_main
 
         # 即是主半边, 也是标记加密的半边
         node = self.entity('node')
@@ -344,13 +417,9 @@ class HalfEdgeMesh(Mesh2d):
         marked[0] = False
 
         #蓝色半边
-        tmp0 = halfedge[halfedge[halfedge[:, 4], 3], 4]
-        tmp1 = halfedge[halfedge[tmp0, 3], 4]
-        flag0 = nlevel[halfedge[:, 0]] > nlevel[halfedge[halfedge[:, 4], 0]]
-        flag1 = nlevel[halfedge[:, 0]] == nlevel[halfedge[halfedge[:, 2], 0]]
-        flag2 = nlevel[halfedge[:, 0]] == nlevel[halfedge[tmp0, 0]]
-        flag3 = nlevel[halfedge[:, 0]] == nlevel[halfedge[tmp1, 0]]
-        flag = flag0 & flag1 & flag2 & flag3
+        ds = self.ds
+        flag = np.zeros(NE, dtype=np.bool_)
+        _quad_blue_hedge(ds.he_v, ds.he_n, ds.he_p, ds.he_o, nlevel, flag)
         isBlueHEdge = halfedge[flag, 4]
 
         #蓝色单元
@@ -426,14 +495,14 @@ class HalfEdgeMesh(Mesh2d):
         markedge[halfedge[edge4[markedge[edge4].astype(bool)], 3]] = 1
         markedge[halfedge[markedge.astype(bool), 4]] = 1
         #边界上的新节点
-        isMainHEdge = (halfedge[:, 5] == 1) # 主半边标记
+        isMainHEdge = self.ds.he_main # 主半边标记
         flag0 = isMainHEdge & markedge.astype(bool)# 即是主半边, 也是标记加密的半边
         flag1 = halfedge[flag0, 4]
         ec = (node[halfedge[flag0, 0]] + node[halfedge[flag1, 0]])/2
         NE1 = len(ec)
         node = np.r_[node, ec]
 
-        nlevel = np.r_[nlevel, np.zeros(NE1, dtype=np.int)]
+        nlevel = np.r_[nlevel, np.zeros(NE1, dtype=nlevel.dtype)]
         nlevel[NN:] = np.maximum(nlevel[halfedge[flag0, 0]], nlevel[halfedge[flag1, 0]])+1
         #被加密半边及加密节点编号
         markedge[flag0] = np.arange(NN, NN+NE1)
@@ -455,7 +524,7 @@ class HalfEdgeMesh(Mesh2d):
 
         #将蓝色单元变为红色单元
         flag = markedge[edge0]!=0
-        NC1 = flag.sum()
+        NC1 = np.count_nonzero(flag)
 
         halfedge[isBlueHEdge[flag], 0] = markedge[edge1[flag]]
         halfedge20 = np.zeros([NC1, 6], dtype=np.int)
@@ -519,7 +588,7 @@ class HalfEdgeMesh(Mesh2d):
                 node[halfedge[celltoedge[valueR!=0, 2], 0]]+
                 node[halfedge[celltoedge[valueR!=0, 3], 0]])/4
         node = np.r_[node, midnode]
-        nlevel = np.r_[nlevel, np.zeros(len(midnode), dtype=np.int)]
+        nlevel = np.r_[nlevel, np.zeros(len(midnode), dtype=nlevel.dtype)]
         midnode = np.zeros(NC)
         midnode[valueR!=0] = np.arange(NN+NE1, node.shape[0])
 
@@ -529,7 +598,7 @@ class HalfEdgeMesh(Mesh2d):
         dx[bluer] = 2
         dx[bluel] = 2
         dx = np.cumsum(dx)
-        clevel = np.r_[clevel, np.zeros(dx[-1], dtype=np.int)]
+        clevel = np.r_[clevel, np.zeros(dx[-1], dtype=clevel.dtype)]
         cell2hedgetest = np.r_[cell2hedgetest, np.zeros(dx[-1], dtype=np.int)]
         dx += NC+NC1
         #新半边编号
@@ -722,14 +791,10 @@ class HalfEdgeMesh(Mesh2d):
         marked[0] = False
 
         #蓝色半边
-        tmp0 = halfedge[halfedge[halfedge[:, 4], 3], 4]
-        flag0 = nlevel[halfedge[:, 0]] > nlevel[halfedge[halfedge[:, 4], 0]]
-        flag1 = nlevel[halfedge[:, 0]] > nlevel[halfedge[halfedge[:, 2], 0]]
-        flag2 = nlevel[halfedge[:, 0]] > nlevel[halfedge[tmp0, 0]]
-        flag3 = halfedge[:, 1] > 0
-        flag4 = halfedge[halfedge[:, 4], 1] > 0
-
-        isBlueHEdge0 = flag0 & flag1 & flag2 & flag3 & flag4
+        ds = self.ds
+        isBlueHEdge0 = np.zeros(NE, dtype=np.bool_)
+        _tri_blue_hedge(ds.he_v, ds.he_c, ds.he_n, ds.he_p, ds.he_o, nlevel,
+                isBlueHEdge0)
         isBlueHEdge = isBlueHEdge0.copy()
         isBlueHEdge[halfedge[isBlueHEdge, 4]] = True
         isBlueHEdge0 = halfedge[halfedge[isBlueHEdge0, 4], 4]
@@ -763,14 +828,14 @@ class HalfEdgeMesh(Mesh2d):
             markedge[halfedge[markedge, 4]] = 1
 
         #边界上的新节点
-        isMainHEdge = (halfedge[:, 5] == 1) # 主半边标记
+        isMainHEdge = self.ds.he_main # 主半边标记
         flag0 = isMainHEdge & markedge # 即是主半边, 也是标记加密的半边
         flag1 = halfedge[flag0, 4]
         ec = (node[halfedge[flag0, 0]] + node[halfedge[flag1, 0]])/2
         NE1 = len(ec)
         node = np.r_[node, ec]
 
-        nlevel = np.r_[nlevel, np.zeros(NE1, dtype=np.int)]
+        nlevel = np.r_[nlevel, np.zeros(NE1, dtype=nlevel.dtype)]
         nlevel[NN:] = np.maximum(nlevel[halfedge[flag0, 0]], nlevel[halfedge[flag1, 0]])+1
         edgeNode = np.zeros(NE, dtype=np.int)#被加密半边及加密节点编号
         edgeNode[flag0] = np.arange(NN, NN+NE1)
@@ -791,7 +856,7 @@ class HalfEdgeMesh(Mesh2d):
         newhalfedge[flag1] = edgeNode[flag1]-NN+NE+NE1
         #将蓝色单元变为红色单元
         flag = markedge[edge2]
-        NC1 = flag.sum()
+        NC1 = np.count_nonzero(flag)
 
         halfedge[halfedge[isBlueHEdge0[flag], 4], 0] = edgeNode[edge3[flag]]
         halfedge20 = np.zeros([NC1, 6], dtype=np.int)
@@ -841,7 +906,7 @@ class HalfEdgeMesh(Mesh2d):
         markedge[edge2[flag]] = 0#加密后的边去除标记
         markedge[edge3[flag]] = 0
 
-        clevel1 = np.zeros(NC1*2)#新单元的层数
+        clevel1 = np.zeros(NC1*2, dtype=clevel.dtype)#新单元的层数
         clevel1[::2] = clevel[halfedge[edge1[flag], 1]]
         clevel1[1::2] = clevel[halfedge[edge1[flag], 1]]
         clevel = np.r_[clevel, clevel1]
@@ -872,7 +937,7 @@ class HalfEdgeMesh(Mesh2d):
         dx[red] = 3
         dx[blue] = 1
         dx = np.cumsum(dx)
-        clevel = np.r_[clevel, np.zeros(dx[-1], dtype=np.int)]
+        clevel = np.r_[clevel, np.zeros(dx[-1], dtype=clevel.dtype)]
         subdomain = np.r_[subdomain, np.zeros(dx[-1], dtype=np.int)]
         dx += NC+NC1*2
         #新半边编号
@@ -988,14 +1053,14 @@ class HalfEdgeMesh(Mesh2d):
             markedge[edge0[flag]] = 1
             markedge[halfedge[markedge, 4]] = 1
         #边界上的新节点
-        isMainHEdge = (halfedge[:, 5] == 1) # 主半边标记
+        isMainHEdge = self.ds.he_main # 主半边标记
         flag0 = isMainHEdge & markedge # 即是主半边, 也是标记加密的半边
         flag1 = halfedge[flag0, 4]
         ec = (node[halfedge[flag0, 0]] + node[halfedge[flag1, 0]])/2
         NE1 = len(ec)
         node = np.r_[node, ec]
 
-        nlevel = np.r_[nlevel, np.zeros(NE1, dtype=np.int)]
+        nlevel = np.r_[nlevel, np.zeros(NE1, dtype=nlevel.dtype)]
         nlevel[NN:] = np.maximum(nlevel[halfedge[flag0, 0]], nlevel[halfedge[flag1, 0]])+1
         newNode = np.zeros(NE, dtype=np.int)#被加密半边及加密节点编号
         newNode[flag0] = np.arange(NN, NN+NE1)
@@ -1022,7 +1087,7 @@ class HalfEdgeMesh(Mesh2d):
         for i in range(2):
             flag = markedge[edge0]
             flag[0] = 0
-            NC1 = flag.sum()
+            NC1 = np.count_nonzero(flag)
 
             halfedge20 = np.zeros([NC1, 6], dtype=np.int)
             halfedge21 = np.zeros([NC1, 6], dtype=np.int)
@@ -1117,7 +1182,7 @@ class HalfEdgeMesh(Mesh2d):
         halfedge = self.ds.halfedge
         subdomain = self.ds.subdomain
 
-        isMainHEdge = (halfedge[:, 5] == 1) # 主半边标记
+        isMainHEdge = self.ds.he_main # 主半边标记
 
         # 标记边
         # 当前半边的层标记小于等于所属单元的层标记
@@ -1134,41 +1199,47 @@ class HalfEdgeMesh(Mesh2d):
         # 即是主半边, 也是标记加密的半边
         flag0 = isMainHEdge & isMarkedHEdge
         idx = halfedge[flag0, 4]
-        ec = (node[halfedge[flag0, 0]] + node[halfedge[idx, 0]])/2
-        NE1 = len(ec)
+        v0 = halfedge[flag0, 0]
+        v1 = halfedge[idx, 0]
+        NE1 = len(v0)
+        ec = np.zeros((NE1, node.shape[1]), dtype=self.ftype)
+        _edge_midvalue(node, v0, v1, ec)
 
         if options['data'] is not None:
             NV = self.ds.number_of_vertices_of_all_cells()
             for key, value in options['data'].items():
-                # 定义在节点的数据进行简单插值
-                evalue = (value[halfedge[flag0, 0]] + value[halfedge[idx, 0]])/2
-                cvalue = np.zeros(NC, dtype=self.ftype)
-                np.add.at(cvalue, halfedge[:, 1], value[halfedge[:, 0]])
+                # 定义在节点的标量数据进行简单插值
+                # 核函数按列计算, 这里传入只有一列的视图, NE1 == 0 时也不用特殊处理
+                evalue = np.zeros(NE1, dtype=self.ftype)
+                _edge_midvalue(value[:, None], v0, v1, evalue[:, None])
+                cvalue = np.bincount(halfedge[:, 1], weights=value[halfedge[:, 0]],
+                        minlength=NC)
                 cvalue /= NV
                 options['data'][key] = np.concatenate((value, evalue, cvalue[isMarkedCell]), axis=0)
 
         #细分边
-        halfedge1 = np.zeros((2*NE1, 6), dtype=self.itype)
-        flag1 = isMainHEdge[isMarkedHEdge] # 标记加密边中的主半边
-        halfedge1[flag1, 0] = range(NN, NN+NE1) # 新的节点编号
-        idx0 = np.argsort(idx) # 当前边的对偶边的从小到大进行排序
-        halfedge1[~flag1, 0] = halfedge1[flag1, 0][idx0] # 按照排序
-
-        hlevel1 = np.zeros(2*NE1, dtype=self.itype)
+        idxMHEdge, = np.nonzero(isMarkedHEdge) # 加密半边的编号
+        # 新半边的单元, 前一个, 对偶边和主边标记都和加密半边相同, 下一个半边
+        # 在后面统一修改
+        halfedge1 = halfedge[idxMHEdge]
+        flag1 = isMainHEdge[idxMHEdge] # 标记加密边中的主半边
+        halfedge1[flag1, 0] = np.arange(NN, NN+NE1) # 新的节点编号
+        # 非主半边的对偶边是主半边, 找到它在 flag0 中的序号, 取同一个新节点
+        inv = np.zeros(2*NE, dtype=self.itype)
+        inv[flag0] = np.arange(NE1)
+        idx0 = inv[halfedge1[~flag1, 4]]
+        halfedge1[~flag1, 0] = halfedge1[flag1, 0][idx0]
+
+        hlevel1 = np.zeros(2*NE1, dtype=hlevel.dtype)
         hlevel1[flag1] = np.maximum(hlevel[flag0], hlevel[halfedge[flag0, 3]]) + 1
         hlevel1[~flag1] = np.maximum(hlevel[idx], hlevel[halfedge[idx, 3]])[idx0]+1
 
-        halfedge1[:, 1] = halfedge[isMarkedHEdge, 1]
-        halfedge1[:, 3] = halfedge[isMarkedHEdge, 3] # 前一个 
-        halfedge1[:, 4] = halfedge[isMarkedHEdge, 4] # 对偶边
-        halfedge1[:, 5] = halfedge[isMarkedHEdge, 5] # 主边标记
-
-        halfedge[isMarkedHEdge, 3] = range(2*NE, 2*NE + 2*NE1)
-        idx = halfedge[isMarkedHEdge, 4] # 原始对偶边
-        halfedge[isMarkedHEdge, 4] = halfedge[idx, 3]  # 原始对偶边的前一条边是新的对偶边
+        halfedge[idxMHEdge, 3] = np.arange(2*NE, 2*NE + 2*NE1)
+        idx = halfedge1[:, 4] # 原始对偶边
+        halfedge[idxMHEdge, 4] = halfedge[idx, 3]  # 原始对偶边的前一条边是新的对偶边
 
-        halfedge = np.r_['0', halfedge, halfedge1]
-        halfedge[halfedge[:, 3], 2] = range(2*NE+2*NE1)
+        halfedge = self.ds.extend_halfedge(halfedge1)
+        halfedge[halfedge[:, 3], 2] = np.arange(2*NE+2*NE1)
         hlevel = np.r_[hlevel, hlevel1]
 
         if dflag:
@@ -1180,15 +1251,14 @@ class HalfEdgeMesh(Mesh2d):
         # 细分单元
         flag = (hlevel - clevel[halfedge[:, 1]]) == 1
         N = halfedge.shape[0]
-        NV = np.zeros(NC, dtype=self.itype)
-        np.add.at(NV, halfedge[:, 1], flag)
-        NHE = sum(NV[isMarkedCell])
+        NV = np.bincount(halfedge[flag, 1], minlength=NC)
+        NHE = NV[isMarkedCell].sum()
 
 
         halfedge1 = np.zeros((2*NHE, 6), dtype=self.itype)
-        hlevel1 = np.zeros(2*NHE, dtype=self.itype)
+        hlevel1 = np.zeros(2*NHE, dtype=hlevel.dtype)
 
-        NC1 = isMarkedCell.sum() # 加密单元个数
+        NC1 = np.count_nonzero(isMarkedCell) # 加密单元个数
 
         # 当前为标记单元的可以加密的半边
         flag0 = flag & isMarkedCell[halfedge[:, 1]]
@@ -1208,11 +1278,11 @@ class HalfEdgeMesh(Mesh2d):
 
              flag1 = isMarkedCell[self.ds.cellstart:]
 
-             NHB0 = flag0.sum()
+             NHB0 = np.count_nonzero(flag0)
              NHB1 = NV1[flag1].sum()
              NHB = NHB0 + NHB1
              HB = np.zeros((NHB, 2), dtype=np.int)
-             HB[:, 0] = range(NHB)
+             HB[:, 0] = np.arange(NHB)
              HB[0:NHB0, 1] = options['HB'][flag0, 1]
              HB[NHB0:,  1] = cellidx -1
              options['HB'] = HB
@@ -1223,26 +1293,21 @@ class HalfEdgeMesh(Mesh2d):
             num[num < 0] = 0
             options['numrefine'] = np.r_[options['numrefine'][~isMarkedCell], num]
 
-        halfedge[idx0, 1] = range(NC, NC + NHE)
+        halfedge[idx0, 1] = np.arange(NC, NC + NHE)
         clevel[isMarkedCell] += 1
 
-        idx1 = idx0.copy()
-        pre = halfedge[idx1, 3]
-        flag0 = ~flag[pre] # 前一个是不需要细分的半边
-        while np.any(flag0):
-            idx1[flag0] = pre[flag0]
-            pre = halfedge[idx1, 3]
-            flag0 = ~flag[pre]
-            halfedge[idx1, 1] = halfedge[idx0, 1]
+        # 从 idx0 往回找到同一个新单元的最后一条半边 idx1, 并修改途经半边的单元编号
+        idx1 = np.zeros_like(idx0)
+        _split_cells(halfedge[:, 3], flag, halfedge[:, 1], idx0, idx1)
 
         nex1 = halfedge[idx1, 2] # 当前半边的下一个半边
         pre1 = halfedge[idx1, 3]
  # 当前半边的上一个半边
 
         cell2newNode = np.full(NC, NN+NE1, dtype=self.itype)
-        cell2newNode[isMarkedCell] += range(isMarkedCell.sum())
-        halfedge[idx0, 2] = range(N, N+NHE) # idx0 的下一个半边的编号
-        halfedge[idx1, 3] = range(N+NHE, N+2*NHE) # idx1 的上一个半边的编号
+        cell2newNode[isMarkedCell] += np.arange(NC1)
+        halfedge[idx0, 2] = np.arange(N, N+NHE) # idx0 的下一个半边的编号
+        halfedge[idx1, 3] = np.arange(N+NHE, N+2*NHE) # idx1 的上一个半边的编号
 
         halfedge1[:NHE, 0] = cell2newNode[cellidx]
         halfedge1[:NHE, 1] = halfedge[idx0, 1]
@@ -1261,14 +1326,14 @@ class HalfEdgeMesh(Mesh2d):
         hlevel1[NHE:] = clevel[cellidx]
 
         clevel = np.r_['0', clevel[~isMarkedCell], clevel[cellidx]]
-        halfedge = np.r_['0', halfedge, halfedge1]
+        halfedge = self.ds.extend_halfedge(halfedge1)
 
         flag = np.zeros(NC+NHE, dtype=np.bool_)
         flag[halfedge[:, 1]] = True
 
         idxmap = np.zeros(NC+NHE, dtype=self.itype)
-        nc = flag.sum()
-        idxmap[flag] = range(nc)
+        nc = np.count_nonzero(flag)
+        idxmap[flag] = np.arange(nc)
         halfedge[:, 1] = idxmap[halfedge[:, 1]]
 
         self.halfedgedata['level'] = np.r_[hlevel, hlevel1]
@@ -1278,6 +1343,48 @@ class HalfEdgeMesh(Mesh2d):
 
 
 
+    def refine_poly_batch(self, markedCells,
+            options={'disp': True, 'data':None}):
+        """
+
+        Parameters
+        ----------
+        markedCells : list of np.ndarray, bool,
+            每个标记数组的长度都等于 len(self.ds.subdomain), 都按加密前的单元
+            编号给出, 同一个单元最多只能被标记一次
+
+        Notes
+        -----
+            依次用 markedCells 中的标记调用 refine_poly 加密网格. 相邻的几组标
+            记中的单元互不相邻 (没有公共边) 时, 分开加密和一起加密得到的网格
+            相同, 这时把它们合并成一次 refine_poly 调用, 减少重建半边数据结构
+            的次数.
+        """
+        NC = self.number_of_all_cells()
+        # 加密前的单元在当前网格中的编号, 已经加密的单元为 -1
+        cidxmap = np.arange(NC)
+        isMarkedCell = np.zeros(NC, dtype=np.bool_)
+        for flag in markedCells:
+            assert len(flag) == NC
+            if np.any(isMarkedCell):
+                # 已标记的单元和与它们有公共边的单元
+                he_c = self.ds.he_c
+                isNearCell = isMarkedCell.copy()
+                isNearCell[he_c[isMarkedCell[he_c[self.ds.he_o]]]] = True
+                if np.any(isNearCell[cidxmap[flag]]):
+                    self.refine_poly(isMarkedCell, options=options)
+                    # 加密后没有加密的单元保持原来的顺序排在最前面
+                    isKeepedCell = ~isMarkedCell
+                    idxmap = np.full(len(isMarkedCell), -1)
+                    idxmap[isKeepedCell] = np.arange(np.count_nonzero(isKeepedCell))
+                    isCell = cidxmap >= 0
+                    cidxmap[isCell] = idxmap[cidxmap[isCell]]
+                    isMarkedCell = np.zeros(self.number_of_all_cells(), dtype=np.bool_)
+            assert np.all(cidxmap[flag] >= 0)
+            isMarkedCell[cidxmap[flag]] = True
+        if np.any(isMarkedCell):
+            self.refine_poly(isMarkedCell, options=options)
+
     def coarsen_poly(self, isMarkedCell, options={'disp': True}):
 
         NC = self.number_of_all_cells()
@@ -1293,15 +1400,14 @@ class HalfEdgeMesh(Mesh2d):
         # 可以移除的网格节点
         # 在理论上, 可以移除点周围的单元所属子区是相同的, TODO: make sure about it
 
-        isRNode = np.ones(NN, dtype=np.bool_)
+        # 一个节点可以移除, 当且仅当指向它的半边都满足下面的条件, 所以只需
+        # 统计每个节点上不满足条件的半边个数
         flag = (hlevel == clevel[halfedge[:, 1]])
-        np.logical_and.at(isRNode, halfedge[:, 0], flag)
-        flag = (hlevel == hlevel[halfedge[:, 4]])
-        np.logical_and.at(isRNode, halfedge[:, 0], flag)
-        flag = isMarkedCell[halfedge[:, 1]]
-        np.logical_and.at(isRNode, halfedge[:, 0], flag)
+        flag &= (hlevel == hlevel[halfedge[:, 4]])
+        flag &= isMarkedCell[halfedge[:, 1]]
+        isRNode = np.bincount(halfedge[~flag, 0], minlength=NN) == 0
 
-        nn = isRNode.sum()
+        nn = np.count_nonzero(isRNode)
 
         if nn > 0:
             # 重新标记要移除的单元
@@ -1310,30 +1416,31 @@ class HalfEdgeMesh(Mesh2d):
             isMarkedCell[halfedge[isMarkedHEdge, 1]] = True
 
             # 没有被标记的单元个数
-            nc = sum(~isMarkedCell[:NC])
+            isNonMarkedCell = ~isMarkedCell[:NC]
+            nc = np.count_nonzero(isNonMarkedCell)
 
             # 更新粗化后单元的所属子区域的信息
             nsd = np.zeros(NN, dtype=self.itype)
             nsd[halfedge[:, 0]] = subdomain[halfedge[:, 1]]
             subdomain = np.zeros(nc+nn, dtype=self.itype)
-            subdomain[:nc] = self.ds.subdomain[~isMarkedCell[:NC]]
+            subdomain[:nc] = self.ds.subdomain[isNonMarkedCell]
             subdomain[nc:] = nsd[isRNode]
 
             # 粗化后单元的新编号: NC:NC+nn 
             nidxmap = np.arange(NN)
-            nidxmap[isRNode] = range(NC, NC+nn)
+            nidxmap[isRNode] = np.arange(NC, NC+nn)
             cidxmap = np.arange(NC)
-            isRHEdge = isRNode[halfedge[:, 0]]
-            cidxmap[halfedge[isRHEdge, 1]] = nidxmap[halfedge[isRHEdge, 0]]
+            idx, = np.nonzero(isRNode[halfedge[:, 0]])
+            cidxmap[halfedge[idx, 1]] = nidxmap[halfedge[idx, 0]]
             halfedge[:, 1] = cidxmap[halfedge[:, 1]]
 
             # 更新粗化后单元的层数
-            nlevel = np.zeros(NN, dtype=self.itype)
+            nlevel = np.zeros(NN, dtype=hlevel.dtype)
             nlevel[halfedge[:, 0]] = hlevel
             level = nlevel[isRNode] - 1
             level[level < 0] = 0
-            clevel = np.zeros(nc+nn, dtype=self.itype)
-            clevel[:nc] = self.celldata['level'][~isMarkedCell[:NC]]
+            clevel = np.zeros(nc+nn, dtype=clevel.dtype)
+            clevel[:nc] = self.celldata['level'][isNonMarkedCell]
             clevel[nc:] = level
             print('c',clevel)
             print('n',nlevel)
@@ -1366,29 +1473,31 @@ class HalfEdgeMesh(Mesh2d):
 
             isMarkedHEdge[flag] = True
             isRNode[halfedge[flag, 0]] = True
-            NN -= nn + flag.sum()//2
+            NN -= nn + np.count_nonzero(flag)//2
 
             # 对节点重新编号
-            nidxmap[~isRNode] = range(NN)
+            nidxmap[~isRNode] = np.arange(NN)
             halfedge[:, 0] = nidxmap[halfedge[:, 0]]
 
             # 对半边重新编号
-            ne = sum(~isMarkedHEdge)
+            isKeepedHEdge = ~isMarkedHEdge
+            ne = np.count_nonzero(isKeepedHEdge)
             eidxmap = np.arange(2*NE)
-            eidxmap[~isMarkedHEdge] = range(ne)
-            halfedge = halfedge[~isMarkedHEdge]
+            eidxmap[isKeepedHEdge] = np.arange(ne)
+            # 原地压缩之后之前的 halfedge 视图失效, 用返回的新视图
+            halfedge = self.ds.compress_halfedge(isKeepedHEdge)
             halfedge[:, 2:5] = eidxmap[halfedge[:, 2:5]]
 
             # 对单元重新编号
             isKeepedCell = np.zeros(NC+nn+1, dtype=np.bool_)
             isKeepedCell[halfedge[:, 1]] = True
             cidxmap = np.zeros(NC+nn+1, dtype=self.itype)
-            NC = sum(isKeepedCell)
-            cidxmap[isKeepedCell] = range(NC)
+            NC = np.count_nonzero(isKeepedCell)
+            cidxmap[isKeepedCell] = np.arange(NC)
             halfedge[:, 1] = cidxmap[halfedge[:, 1]]
 
             # 更新层信息
-            self.halfedgedata['level'] = hlevel[~isMarkedHEdge]
+            self.halfedgedata['level'] = hlevel[isKeepedHEdge]
             self.celldata['level'] = clevel
 
             # 更新节点和半边数据结构信息
@@ -1399,7 +1508,7 @@ class HalfEdgeMesh(Mesh2d):
                 # 粗化要更新 HB[:, 0]
                 NHB = self.number_of_cells()
                 HB = np.zeros((NHB, 2), dtype=np.int)
-                HB[:, 0] = range(NHB)
+                HB[:, 0] = np.arange(NHB)
                 print('HB:', options['HB'])
 
 
@@ -1413,6 +1522,23 @@ class HalfEdgeMesh(Mesh2d):
         return isMarkedCell
 
 
+    def mark_buffer(self):
+        """
+
+        Notes
+        -----
+            返回长度为 number_of_all_cells() 的全 False 单元标记数组, 它是缓冲
+            区 self._mark_scratch 的视图, 缓冲区只在单元个数超过容量时按 2 倍
+            增长. 下一次调用时数组会被清空, 不要用它保存需要长期使用的标记.
+        """
+        NC = self.number_of_all_cells()
+        if len(self._mark_scratch) < NC:
+            self._mark_scratch = np.empty(max(2*len(self._mark_scratch), NC),
+                    dtype=np.bool_)
+        isMarkedCell = self._mark_scratch[:NC]
+        isMarkedCell.fill(False)
+        return isMarkedCell
+
     def refine_marker(self, eta, theta, method="L2"):
         NC = self.number_of_all_cells()
         isMarkedCell = np.zeros(NC, dtype=np.bool_)
@@ -1497,17 +1623,18 @@ class HalfEdgeMesh(Mesh2d):
         options['numrefine'][flag] = -options['maxcoarsen']
 
         # refine
-        isMarkedCell = (options['numrefine'] > 0)
+        isMarkedCell = np.greater(options['numrefine'], 0, out=self.mark_buffer())
 
         while np.any(isMarkedCell):
             self.refine_poly(isMarkedCell,options)
-            isMarkedCell = (options['numrefine'] > 0)
+            isMarkedCell = np.greater(options['numrefine'], 0,
+                    out=self.mark_buffer())
 
 
         # coarsen
         if options['maxcoarsen'] > 0:
             isMarkedCell = (options['numrefine'] < 0)
-            while sum(isMarkedCell) > 0:
+            while np.any(isMarkedCell):
                 NN0 = self.number_of_cells()
                 self.coarsen_poly(isMarkedCell,options)
                 NN = self.number_of_cells()
@@ -1575,18 +1702,161 @@ class HalfEdgeMesh2dDataStructure():
         self.halfedge = halfedge
 
         self.cell2hedge = np.zeros(NC, dtype=self.itype)   # 存储每个单元的起始半边
-        self.cell2hedge[halfedge[:, 1]] = range(2*self.NE) # 的编号
+        self.cell2hedge[self.he_c] = range(2*self.NE) # 的编号
 
         if NV is None:
             NC = self.NC
             halfedge = self.halfedge
             hflag = self.hflag
             cidxmap = self.cidxmap
-            self.NV = np.zeros(NC, dtype=self.itype)
-            np.add.at(self.NV, cidxmap[halfedge[hflag, 1]], 1)
+            self.NV = np.bincount(cidxmap[halfedge[hflag, 1]],
+                    minlength=NC).astype(self.itype)
         else:
             assert NV == 3 or NV == 4
             self.NV = NV
+        self._cellLocation = None
+
+    @property
+    def halfedge(self):
+        """
+        (2*NE, 6) 的半边数组, 是按列连续存储的 self._halfedge 的转置视图,
+        不会复制数据, 对它的修改会直接写回到数据结构中.
+        """
+        return self._view
+
+    @halfedge.setter
+    def halfedge(self, halfedge):
+        # 传入的就是当前的半边数组 (比如加密时 extend_halfedge 返回的数组)
+        # 时直接使用, 不再复制
+        if halfedge is not getattr(self, '_view', None):
+            self._buf = np.array(halfedge.T, order='C')
+        self._set_size(halfedge.shape[0])
+
+    def _set_size(self, N):
+        # 半边的 6 个属性各自连续存储 (SoA) 在 self._buf 的前 N 列中, 按列
+        # 遍历半边时只读取需要的数据
+        self._halfedge = self._buf[:, :N]
+        self._view = self._halfedge.T
+        self.he_v = self._halfedge[0] # 指向的节点
+        self.he_c = self._halfedge[1] # 所属的单元
+        self.he_n = self._halfedge[2] # 下一条半边
+        self.he_p = self._halfedge[3] # 前一条半边
+        self.he_o = self._halfedge[4] # 对偶半边
+        self.he_m = self._halfedge[5] # 主半边标记
+
+        # 主半边标记和半边到边的编号映射在第一次用到时才生成, 半边数组改变
+        # 后重新置空
+        self._he_main = None
+        self._J = None
+        self._node2hedge = None
+
+    def _ensure_capacity(self, n):
+        """
+        保证半边缓冲区至少能存放 n 条半边, 容量不够时按 1.5 倍增长
+        """
+        capacity = self._buf.shape[1]
+        if n > capacity:
+            N = self._halfedge.shape[1]
+            buf = np.empty((6, max(n, int(1.5*capacity))), dtype=self._buf.dtype)
+            buf[:, :N] = self._halfedge
+            self._buf = buf
+
+    def extend_halfedge(self, halfedge):
+        """
+
+        Notes
+        -----
+            在半边数组的末尾追加新的半边, 返回追加后的 (N, 6) 半边数组.
+            缓冲区有剩余容量时不会重新分配内存和复制已有的半边.
+
+            这里只更新半边数组, 网格的其它信息需要随后调用 reinit 更新.
+        """
+        N = self._halfedge.shape[1]
+        N1 = N + len(halfedge)
+        self._ensure_capacity(N1)
+        self._buf[:, N:N1] = halfedge.T
+        self._set_size(N1)
+        return self._view
+
+    def compress_halfedge(self, flag):
+        """
+
+        Notes
+        -----
+            在缓冲区中原地删除 flag 为 False 的半边, 保留的半边按原来的顺序移到
+            前面, 返回删除后的 (N, 6) 半边数组. 每次只复制一行属性, 不需要再分配
+            一个完整的半边数组.
+
+            注意调用之前拿到的 ds.halfedge 视图在调用之后就失效了, 调用者要使用
+            这里的返回值或者重新读取 ds.halfedge.
+
+            这里只更新半边数组, 网格的其它信息需要随后调用 reinit 更新.
+        """
+        N = np.count_nonzero(flag)
+        for row in self._halfedge:
+            row[:N] = row[flag]
+        self._set_size(N)
+        return self._view
+
+    @property
+    def cellLocation(self):
+        """
+        多边形网格中每个单元的半边在 cell_to_node 等数组中的起始位置, 第一次
+        用到时由 NV 生成. 这个数组会被缓存并直接返回给调用者, 所以设为只读,
+        需要修改时请先复制
+        """
+        if self._cellLocation is None:
+            cellLocation = np.zeros(self.NC+1, dtype=self.itype)
+            cellLocation[1:] = np.cumsum(self.NV)
+            cellLocation.setflags(write=False)
+            self._cellLocation = cellLocation
+        return self._cellLocation
+
+    @property
+    def he_main(self):
+        """
+        主半边的布尔标记, 由第 5 列的整数标记生成
+        """
+        if self._he_main is None:
+            self._he_main = (self.he_m == 1)
+        return self._he_main
+
+    @property
+    def J(self):
+        """
+        半边到边的编号映射, 主半边及其对偶半边对应同一条边
+        """
+        if self._J is None:
+            NE = self.NE
+            isMainHEdge = self.he_main
+            J = np.zeros(2*NE, dtype=self.itype)
+            J[isMainHEdge] = range(NE)
+            J[self.he_o[isMainHEdge]] = range(NE)
+            self._J = J
+        return self._J
+
+    @property
+    def node2hedge(self):
+        """
+        节点到从它出发的半边的 CSR 格式索引 (location, hedge), 节点 i 对应的
+        半边为 hedge[location[i]:location[i+1]], 第一次用到时生成
+        """
+        if self._node2hedge is None:
+            NN = self.NN
+            # 半边的起点是前一条半边指向的节点
+            he_s = self.he_v[self.he_p]
+            hedge = np.argsort(he_s, kind='stable').astype(self.itype)
+            location = np.zeros(NN+1, dtype=self.itype)
+            location[1:] = np.cumsum(np.bincount(he_s, minlength=NN))
+            self._node2hedge = (location, hedge)
+        return self._node2hedge
+
+    def halfedges_of_node(self, i):
+        """
+        从节点 i 出发的所有半边的编号
+        """
+        location, hedge = self.node2hedge
+        return hedge[location[i]:location[i+1]]
 
 
     def number_of_all_cells(self):
@@ -1595,8 +1865,7 @@ class HalfEdgeMesh2dDataStructure():
     def number_of_vertices_of_all_cells(self):
         NC = self.number_of_all_cells()
         halfedge = self.halfedge
-        NV = np.zeros(NC, dtype=self.itype)
-        np.add.at(NV, halfedge[:, 1], 1)
+        NV = np.bincount(halfedge[:, 1], minlength=NC)
         return NV
 
     def number_of_vertices_of_cells(self):
@@ -1611,6 +1880,28 @@ class HalfEdgeMesh2dDataStructure():
     def number_of_faces_of_cells(self):
         return self.NV
 
+    def cell_to_halfedge(self, shift=0):
+        """
+
+        Parameters
+        ----------
+        shift : int
+            每个单元从 cell2hedge 中的起始半边往后 shift 条半边开始
+
+        Notes
+        -----
+            多边形网格中按单元依次排列的半边编号. shift=0 时每个单元从
+            cell2hedge 中的起始半边开始, 与 cell_to_node 返回的顶点一一对应;
+            shift=1 时与 cell_to_edge 返回的边一一对应.
+        """
+        cellLocation = self.cellLocation
+        start = self.cell2hedge[self.cellstart:]
+        for i in range(shift):
+            start = self.he_n[start]
+        cell2hedge = np.zeros(cellLocation[-1], dtype=self.itype)
+        walk_cells(self.he_n, start, cellLocation, cell2hedge)
+        return cell2hedge, cellLocation
+
     def cell_to_node(self, return_sparse=False):
         NN = self.NN
         NC = self.NC
@@ -1620,29 +1911,25 @@ class HalfEdgeMesh2dDataStructure():
         cidxmap = self.cidxmap
 
         if return_sparse:
-            val = np.ones(hflag.sum(), dtype=np.bool_)
-            I = cidxmap[halfedge[hflag, 1]]
-            J = halfedge[hflag, 0]
+            if type(self.NV) is np.ndarray:
+                # 按单元排列的半边正好是 CSR 格式的各行, 不需要再排序合并.
+                # indptr 用缓存的 cellLocation 的副本, 矩阵的原地操作不会改到缓存
+                cell2hedge, cellLocation = self.cell_to_halfedge()
+                val = np.ones(len(cell2hedge), dtype=np.bool_)
+                cell2node = csr_matrix((val, self.he_v[cell2hedge], cellLocation.copy()),
+                        shape=(NC, NN), dtype=np.bool_)
+                return cell2node
+            val = np.ones(np.count_nonzero(hflag), dtype=np.bool_)
+            I = cidxmap[self.he_c[hflag]]
+            J = self.he_v[hflag]
             cell2node = csr_matrix((val, (I, J)), shape=(NC, NN), dtype=np.bool_)
             return cell2node
         elif type(self.NV) is np.ndarray: # polygon mesh
-            cellLocation = np.zeros(NC+1, dtype=self.itype)
-            cellLocation[1:] = np.cumsum(self.NV)
-            cell2node = np.zeros(cellLocation[-1], dtype=self.itype)
-            current = self.cell2hedge[cstart:]
-            idx = cellLocation[:-1].copy()
-            cell2node[idx] = halfedge[current, 0]
-            NV0 = np.ones(NC, dtype=self.itype)
-            isNotOK = NV0 < self.NV
-            while isNotOK.sum() > 0:
-               current[isNotOK] = halfedge[current[isNotOK], 2]
-               idx[isNotOK] += 1
-               NV0[isNotOK] += 1
-               cell2node[idx[isNotOK]] = halfedge[current[isNotOK], 0]
-               isNotOK = (NV0 < self.NV)
+            cell2hedge, cellLocation = self.cell_to_halfedge()
+            cell2node = self.he_v[cell2hedge]
             return cell2node, cellLocation
         elif self.NV == 3: # tri mesh
-            cell2node = np.zeros([NC, 3], dtype=np.int_)
+            cell2node = np.zeros((NC, 3), dtype=self.itype)
             current = self.cell2hedge[cstart:]
             cell2node[:, 0] = halfedge[current, 0]
             current = halfedge[current, 2]
@@ -1651,7 +1938,7 @@ class HalfEdgeMesh2dDataStructure():
             cell2node[:, 2] = halfedge[current, 0]
             return cell2node
         elif self.NV == 4: # quad mesh
-            cell2node = np.zeros([NC, 4], dtype=np.int_)
+            cell2node = np.zeros((NC, 4), dtype=self.itype)
             current = self.cell2hedge[cstart:]
             cell2node[:, 0] = halfedge[current, 0]
             current = halfedge[current, 2]
@@ -1672,42 +1959,31 @@ class HalfEdgeMesh2dDataStructure():
         cstart = self.cellstart
         hflag = self.hflag
 
-        J = np.zeros(2*NE, dtype=self.itype)
-        isMainHEdge = (halfedge[:, 5] == 1)
-        J[isMainHEdge] = range(NE)
-        J[halfedge[isMainHEdge, 4]] = range(NE)
+        J = self.J
         if return_sparse:
+            if type(self.NV) is np.ndarray:
+                cell2hedge, cellLocation = self.cell_to_halfedge()
+                val = np.ones(len(cell2hedge), dtype=np.bool_)
+                cell2edge = csr_matrix((val, J[cell2hedge], cellLocation.copy()),
+                        shape=(NC, NE), dtype=np.bool_)
+                return cell2edge
             val = np.ones(2*NE, dtype=np.bool_)
-            cell2edge = csr_matrix((val[hflag], (halfedge[hflag, 1],
+            cell2edge = csr_matrix((val[hflag], (self.cidxmap[self.he_c[hflag]],
                 J[hflag])), shape=(NC, NE), dtype=np.bool_)
             return cell2edge
         elif type(self.NV) is np.ndarray:
-
-            cellLocation = np.zeros(NC+1, dtype=self.itype)
-            cellLocation[1:] = np.cumsum(self.NV)
-
-            cell2edge = np.zeros(cellLocation[-1], dtype=self.itype)
-            current = halfedge[self.cell2hedge[cstart:], 2] # 下一个边
-            idx = cellLocation[:-1]
-            cell2edge[idx] = J[current]
-            NV0 = np.ones(NC, dtype=self.itype)
-            isNotOK = NV0 < self.NV
-            while isNotOK.sum() > 0:
-                current[isNotOK] = halfedge[current[isNotOK], 2]
-                idx[isNotOK] += 1
-                NV0[isNotOK] += 1
-                cell2edge[idx[isNotOK]] = J[current[isNotOK]]
-                isNotOK = (NV0 < self.NV)
+            cell2hedge, _ = self.cell_to_halfedge(shift=1)
+            cell2edge = J[cell2hedge]
             return cell2edge
         elif self.NV == 3: # tri mesh
-            cell2edge = np.zeros(NC, 3)
+            cell2edge = np.zeros((NC, 3), dtype=self.itype)
             current = self.cell2hedge[cstart:]
             cell2edge[:, 1] = J[current]
             cell2edge[:, 2] = J[halfedge[current, 2]]
             cell2edge[:, 0] = J[halfedge[current, 3]]
             return cell2edge
         elif self.NV == 4: # quad mesh
-            cell2edge = np.zeros(NC, 4)
+            cell2edge = np.zeros((NC, 4), dtype=self.itype)
             current = self.cell2hedge[cstart:]
             cell2edge[:, 3] = J[current]
             current = halfedge[current, 2]
@@ -1731,22 +2007,21 @@ class HalfEdgeMesh2dDataStructure():
         cidxmap = self.cidxmap
         if return_sparse:
             flag = hflag & hflag[halfedge[:, 4]]
-            val = np.ones(flag.sum(), dtype=np.bool_)
+            val = np.ones(np.count_nonzero(flag), dtype=np.bool_)
             I = halfedge[flag, 1]
             J = halfedge[halfedge[flag, 4], 1]
             cell2cell = coo_matrix((val, (I, J)), shape=(NC, NC), dtype=np.bool_)
             cell2cell+= coo_matrix((val, (J, I)), shape=(NC, NC), dtype=np.bool_)
             return cell2cell.tocsr()
         elif type(self.NV) is np.ndarray:
-            cellLocation = np.zeros(NC+1, dtype=self.itype)
-            cellLocation[1:] = np.cumsum(self.NV)
+            cellLocation = self.cellLocation
             cell2cell = np.zeros(cellLocation[-1], dtype=self.itype)
             current = halfedge[self.cell2hedge[cstart:], 2] # 下一个边
-            idx = cellLocation[:-1]
+            idx = cellLocation[:-1].copy()
             cell2cell[idx] = cidxmap[halfedge[halfedge[current, 4], 1]]
             NV0 = np.ones(NC, dtype=self.itype)
             isNotOK = NV0 < self.NV
-            while isNotOK.sum() > 0:
+            while np.any(isNotOK):
                 current[isNotOK] = halfedge[current[isNotOK], 2]
                 idx[isNotOK] += 1
                 NV0[isNotOK] += 1
@@ -1787,7 +2062,7 @@ class HalfEdgeMesh2dDataStructure():
         NN = self.NN
         NE = self.NE
         halfedge = self.halfedge
-        isMainHEdge = halfedge[:, 5] == 1
+        isMainHEdge = self.he_main
         if return_sparse == False:
             edge = np.zeros((NE, 2), dtype=self.itype)
             edge[:, 0] = halfedge[halfedge[isMainHEdge, 4], 0]
@@ -1810,64 +2085,59 @@ class HalfEdgeMesh2dDataStructure():
         cstart = self.cellstart
         cidxmap = self.cidxmap
 
-        J = np.zeros(2*NE, dtype=self.itype)
-        isMainHEdge = (halfedge[:, 5] == 1)
-        J[isMainHEdge] = range(NE)
-        J[halfedge[isMainHEdge, 4]] = range(NE)
+        J = self.J
+        isMainHEdge = self.he_main
+        he_c, he_o = self.he_c, self.he_o
         edge2cell = np.full((NE, 4), -1, dtype=self.itype)
-        edge2cell[J[isMainHEdge], 0] = cidxmap[halfedge[isMainHEdge, 1]]
-        edge2cell[J[halfedge[isMainHEdge, 4]], 1] = cidxmap[halfedge[halfedge[isMainHEdge, 4], 1]]
+        edge2cell[J[isMainHEdge], 0] = cidxmap[he_c[isMainHEdge]]
+        edge2cell[J[he_o[isMainHEdge]], 1] = cidxmap[he_c[he_o[isMainHEdge]]]
         if type(self.NV) is np.ndarray:
-            current = halfedge[self.cell2hedge[cstart], 2] # 下一个边
-            end = current.copy()
-            lidx = np.zeros_like(current)
-            isNotOK = np.ones_like(current, dtype=np.bool_)
-            while np.any(isNotOK):
-                idx = J[current[isNotOK]]
-                flag = (halfedge[current[isNotOK], 5] == 1)
-                edge2cell[idx[flag], 2] = lidx[isNotOK][flag]
-                edge2cell[idx[~flag], 3] = lidx[isNotOK][~flag]
-                current[isNotOK] = halfedge[current[isNotOK], 2]
-                lidx[isNotOK] += 1
-                isNotOK = (current != end)
+            # 和 cell_to_edge 一样绕每个单元走一圈, 半边在单元中的位置就是
+            # 它对应的边的局部编号
+            cell2hedge, cellLocation = self.cell_to_halfedge(shift=1)
+            lidx = np.arange(cellLocation[-1]) - np.repeat(cellLocation[:-1], self.NV)
+            idx = J[cell2hedge]
+            flag = isMainHEdge[cell2hedge]
+            edge2cell[idx[flag], 2] = lidx[flag]
+            edge2cell[idx[~flag], 3] = lidx[~flag]
         elif self.NV == 3:
             current = self.cell2hedge[cstart]
             idx = J[current]
-            flag = halfedge[current, 5] == 1 
+            flag = isMainHEdge[current]
             edge2cell[idx[flag], 2] = 1
             edge2cell[idx[~flag], 3] = 1
 
             idx = J[halfedge[current, 2]]
-            flag = halfedge[halfedge[current, 2], 5] == 1 
+            flag = isMainHEdge[halfedge[current, 2]]
             edge2cell[idx[flag], 2] = 2
             edge2cell[idx[~flag], 3] = 2
 
             idx = J[halfedge[current, 3]]
-            flag = halfedge[halfedge[current, 3], 5] == 1 
+            flag = isMainHEdge[halfedge[current, 3]]
             edge2cell[idx[flag], 2] = 0
             edge2cell[idx[~flag], 3] = 0
         elif self.NV == 4:
             current = self.cell2hedge[cstart]
             idx = J[current]
-            flag = halfedge[current, 5] == 1 
+            flag = isMainHEdge[current]
             edge2cell[idx[flag], 2] = 3
             edge2cell[idx[~flag], 3] = 3
 
             current = halfedge[current, 2]
             idx = J[current]
-            flag = halfedge[current, 5] == 1 
+            flag = isMainHEdge[current]
             edge2cell[idx[flag], 2] = 0
             edge2cell[idx[~flag], 3] = 0
 
             current = halfedge[current, 2]
             idx = J[current]
-            flag = halfedge[current, 5] == 1 
+            flag = isMainHEdge[current]
             edge2cell[idx[flag], 2] = 1
             edge2cell[idx[~flag], 3] = 1
 
             current = halfedge[current, 2]
             idx = J[current]
-            flag = halfedge[current, 5] == 1 
+            flag = isMainHEdge[current]
             edge2cell[idx[flag], 2] = 2
             edge2cell[idx[~flag], 3] = 2
         else:
@@ -1895,7 +2165,7 @@ class HalfEdgeMesh2dDataStructure():
         hflag = self.hflag
         cidxmap = self.cidxmap
 
-        val = np.ones(hflag.sum(), dtype=np.bool_)
+        val = np.ones(np.count_nonzero(hflag), dtype=np.bool_)
         I = halfedge[hflag, 0]
         J = cidxmap[halfedge[hflag, 1]]
         node2cell = csr_matrix((val, (I.flat, J.flat)), shape=(NN, NC), dtype=np.bool_)
@@ -1911,15 +2181,11 @@ class HalfEdgeMesh2dDataStructure():
         return isBdNode
 
     def boundary_edge_flag(self):
-        NE = self.NE
-        halfedge =  self.halfedge
+        # 边按主半边的顺序编号, 主半边和它的对偶半边中只有一个属于内部单元时
+        # 是边界边
+        isMainHEdge = self.he_main
         hflag = self.hflag
-        isBdHEdge = hflag & (~hflag[halfedge[:, 4]])
-
-        J = np.zeros(2*NE, dtype=self.itype)
-        isMainHEdge = (halfedge[:, 5] == 1)
-        J[isMainHEdge] = range(NE)
-        return J[isBdHEdge] 
+        return hflag[isMainHEdge] != hflag[self.he_o[isMainHEdge]]
 
     def boundary_edge(self):
         edge = self.edge_to_node()
@@ -1932,7 +2198,7 @@ class HalfEdgeMesh2dDataStructure():
         isBdHEdge = hflag & (~hflag[halfedge[:, 4]])
 
         isBdCell = np.zeros(NC, dtype=np.bool_)
-        idx = cidxmap[halfedge[isBdHEdge, 1]]
+        idx = self.cidxmap[halfedge[isBdHEdge, 1]]
         isBdCell[idx] = True
         return isBdCell
 
@@ -1952,4 +2218,4 @@ class HalfEdgeMesh2dDataStructure():
         return idx
 
     def main_halfedge_flag(self):
-        return self.halfedge[:, 5] == 1
+        return self.he_main.copy()
@@ -3,6 +3,29 @@ from scipy.sparse import coo_matrix, csc_matrix, csr_matrix, spdiags, eye, tril,
 from ..quadrature import TriangleQuadrature
 from .Mesh2d import Mesh2d
 from .adaptive_tools import mark
+from .halfedge_kernels import njit, prange, walk_cells
+
+
+@njit(parallel=True, cache=True)
+def _backtrack_cells(pre, cell, rflag, idx0, idx1):
+    """
+
+    Notes
+    -----
+    从每条加密半边 idx0[i] 沿前一条半边 pre 往回走, 直到前一条半边的标签为 1.
+    经过的半边标签减 1 (不小于 0), 并归到 idx0[i] 所在的新单元中, 最后停下
+    的半边存入 idx1[i]. 不同的 idx0[i] 经过的半边互不相交, 可以并行.
+    """
+    for i in prange(len(idx0)):
+        h = idx0[i]
+        c = cell[h]
+        p = pre[h]
+        while rflag[p] != 1:
+            h = p
+            rflag[h] = max(rflag[h] - 1, 0)
+            cell[h] = c
+            p = pre[h]
+        idx1[i] = h
 
 class HalfEdgePolygonMesh(Mesh2d):
     def __init__(self, node, halfedge, NC):
@@ -125,8 +148,8 @@ class HalfEdgePolygonMesh(Mesh2d):
         node = self.node
         cell, cellLocation = self.entity('cell')
 
-        idx1 = np.zeros(cell.shape[0], dtype=np.int)
-        idx2 = np.zeros(cell.shape[0], dtype=np.int)
+        idx1 = np.zeros(cell.shape[0], dtype=self.itype)
+        idx2 = np.zeros(cell.shape[0], dtype=self.itype)
 
         idx1[0:-1] = cell[1:]
         idx1[cellLocation[1:]-1] = cell[cellLocation[:-1]]
@@ -145,7 +168,7 @@ class HalfEdgePolygonMesh(Mesh2d):
         e0 = halfedge[halfedge[:, 3], 0]
         e1 = halfedge[:, 0]
 
-        w = np.array([[0, -1], [1, 0]], dtype=np.int)
+        w = np.array([[0, -1], [1, 0]], dtype=self.ftype)
         v= (node[e1] - node[e0])@w
         val = np.sum(v*node[e0], axis=1)
 
@@ -164,7 +187,7 @@ class HalfEdgePolygonMesh(Mesh2d):
         e0 = halfedge[halfedge[:, 3], 0]
         e1 = halfedge[:, 0]
 
-        w = np.array([[0, -1], [1, 0]], dtype=np.int)
+        w = np.array([[0, -1], [1, 0]], dtype=self.ftype)
         v= (node[e1] - node[e0])@w
         val = np.sum(v*node[e0], axis=1)
         ec = val.reshape(-1, 1)*(node[e1]+node[e0])/2
@@ -231,16 +254,19 @@ class HalfEdgePolygonMesh(Mesh2d):
             NV = self.ds.number_of_vertices_of_cells(returnall=True)
             for key, value in data.items():
                 evalue = (value[halfedge[flag0, 0]] + value[halfedge[idx, 0]])/2
-                cvalue = np.zeros(NC+1, dtype=self.ftype)
-                np.add.at(cvalue, halfedge[:, 1], value[halfedge[:, 0]])
+                cvalue = np.bincount(halfedge[:, 1], weights=value[halfedge[:, 0]],
+                        minlength=NC+1)
                 cvalue /= NV
                 data[key] = np.concatenate((value, evalue, cvalue[isMarkedCell]), axis=0)
         #细分边
         halfedge1 = np.zeros((2*NE1, 6), dtype=self.itype)
         flag1 = isMainHEdge[isMarkedHEdge]
         halfedge1[flag1, 0] = range(NN, NN+NE1) # 新的节点编号
-        idx0 = np.argsort(idx) # 当前边的对偶边的从小到大进行排序
-        halfedge1[~flag1, 0] = halfedge1[flag1, 0][idx0] # 按照排序
+        # 非主半边的对偶边是主半边, 找到它在 flag0 中的序号, 取同一个新节点
+        inv = np.zeros(2*NE, dtype=self.itype)
+        inv[flag0] = np.arange(NE1)
+        idx0 = inv[halfedge[isMarkedHEdge, 4][~flag1]]
+        halfedge1[~flag1, 0] = halfedge1[flag1, 0][idx0]
 
         rflag1 = np.zeros(2*NE1, dtype=self.itype)
         rflag1[flag1] = np.maximum(rflag0[flag0], rflag0[halfedge[flag0, 3]])
@@ -268,9 +294,8 @@ class HalfEdgePolygonMesh(Mesh2d):
 
         # 细分单元
         N = halfedge.shape[0]
-        NV = np.zeros(NC+1, dtype=self.itype)
-        np.add.at(NV, halfedge[:, 1], rflag0 == 1)
-        NHE = sum(NV[isMarkedCell])
+        NV = np.bincount(halfedge[rflag0 == 1, 1], minlength=NC+1)
+        NHE = NV[isMarkedCell].sum()
         halfedge1 = np.zeros((2*NHE, 6), dtype=self.itype)
         
         NC1 = isMarkedCell.sum() # 加密的单元个数
@@ -287,15 +312,8 @@ class HalfEdgePolygonMesh(Mesh2d):
         cellidx = halfedge[idx0, 1]
         halfedge[idx0, 1] = range(NC, NC + NHE)
         
-        idx1 = idx0.copy()
-        pre = halfedge[idx1, 3]
-        flag = (rflag0[pre] != 1)
-        while np.any(flag):
-            idx1[flag] = pre[flag]
-            rflag0[pre[flag]] = np.maximum(rflag0[pre[flag]]-1, 0)
-            pre = halfedge[idx1, 3]
-            flag = (rflag0[pre] != 1)
-            halfedge[idx1, 1] = halfedge[idx0, 1]
+        idx1 = np.zeros_like(idx0)
+        _backtrack_cells(halfedge[:, 3], halfedge[:, 1], rflag0, idx0, idx1)
         rflag0[idx0] = 0
             
         nex1 = halfedge[idx1, 2] # 下一个
@@ -326,7 +344,7 @@ class HalfEdgePolygonMesh(Mesh2d):
         halfedge = np.r_['0', halfedge, halfedge1]
 
         flag = np.zeros(NC+NHE+1, dtype=np.bool_)
-        np.add.at(flag, halfedge[:, 1], True)
+        flag[halfedge[:, 1]] = True
         idxmap = np.zeros(NC+NHE+1, dtype=self.itype)
         NC = flag.sum()
 
@@ -476,7 +494,14 @@ class HalfEdgePolygonMeshDataStructure():
         self.itype = halfedge.dtype
 
         self.cell2hedge = np.zeros(NC+1, dtype=self.itype)
-        self.cell2hedge[halfedge[:, 1]] = range(2*self.NE)
+        self.cell2hedge[self.he_c] = range(2*self.NE)
+
+        # 属于外部虚拟单元 NC 的边界半边的编号
+        self.bd_halfedges = np.flatnonzero(self.he_c == NC).astype(self.itype)
+
+        # 边界节点, 边和单元的标记及编号, 第一次用到时计算, 网格加密或粗化后
+        # 调用 reinit 时清空. 缓存的数组直接返回给调用者, 都设为只读
+        self._bd_cache = {}
 
     def reinit(self, NN, NC, halfedge):
         self.NN = NN
@@ -487,7 +512,33 @@ class HalfEdgePolygonMeshDataStructure():
         self.itype = halfedge.dtype
 
         self.cell2hedge = np.zeros(NC+1, dtype=self.itype)
-        self.cell2hedge[halfedge[:, 1]] = range(2*self.NE)
+        self.cell2hedge[self.he_c] = range(2*self.NE)
+
+        # 属于外部虚拟单元 NC 的边界半边的编号
+        self.bd_halfedges = np.flatnonzero(self.he_c == NC).astype(self.itype)
+
+        # 边界节点, 边和单元的标记及编号, 第一次用到时计算, 网格加密或粗化后
+        # 调用 reinit 时清空. 缓存的数组直接返回给调用者, 都设为只读
+        self._bd_cache = {}
+
+    @property
+    def halfedge(self):
+        """
+        (2*NE, 6) 的半边数组, 是按列连续存储的 self._halfedge 的转置视图,
+        不会复制数据, 对它的修改会直接写回到数据结构中.
+        """
+        return self._halfedge.T
+
+    @halfedge.setter
+    def halfedge(self, halfedge):
+        # 半边的 6 个属性各自连续存储 (SoA), 按列遍历半边时只读取需要的数据
+        self._halfedge = np.array(halfedge.T, order='C')
+        self.he_v = self._halfedge[0] # 指向的节点
+        self.he_c = self._halfedge[1] # 所属的单元
+        self.he_n = self._halfedge[2] # 下一条半边
+        self.he_p = self._halfedge[3] # 前一条半边
+        self.he_o = self._halfedge[4] # 对偶半边
+        self.he_m = self._halfedge[5] # 主半边标记
 
     def number_of_vertices_of_cells(self, returnall=False):
         NC = self.NC
@@ -526,18 +577,9 @@ class HalfEdgePolygonMeshDataStructure():
             NV = self.number_of_vertices_of_cells()
             cellLocation = np.zeros(NC+1, dtype=self.itype)
             cellLocation[1:] = np.cumsum(NV)
-            cell2node = np.zeros(cellLocation[-1], dtype=self.itype)
-            current = self.cell2hedge.copy()[:NC]
-            idx = cellLocation[:-1].copy()
-            cell2node[idx] = halfedge[current, 0]
-            NV0 = np.ones(NC, dtype=self.itype)
-            isNotOK = NV0 < NV
-            while isNotOK.sum() > 0:
-               current[isNotOK] = halfedge[current[isNotOK], 2]
-               idx[isNotOK] += 1
-               NV0[isNotOK] += 1
-               cell2node[idx[isNotOK]] = halfedge[current[isNotOK], 0]
-               isNotOK = (NV0 < NV)
+            hedge = np.zeros(cellLocation[-1], dtype=self.itype)
+            walk_cells(self.he_n, self.cell2hedge[:NC], cellLocation, hedge)
+            cell2node = self.he_v[hedge]
             return cell2node, cellLocation
 
     def cell_to_edge(self, sparse=False):
@@ -560,18 +602,10 @@ class HalfEdgePolygonMeshDataStructure():
             NV = self.number_of_vertices_of_cells()
             cellLocation = np.zeros(NC+1, dtype=self.itype)
             cellLocation[1:] = np.cumsum(NV)
-            cell2edge = np.zeros(cellLocation[-1], dtype=self.itype)
-            current = halfedge[self.cell2hedge[:-1], 2] # 下一个边
-            idx = cellLocation[:-1]
-            cell2edge[idx] = J[current]
-            NV0 = np.ones(NC, dtype=self.itype)
-            isNotOK = NV0 < NV
-            while isNotOK.sum() > 0:
-                current[isNotOK] = halfedge[current[isNotOK], 2]
-                idx[isNotOK] += 1
-                NV0[isNotOK] += 1
-                cell2edge[idx[isNotOK]] = J[current[isNotOK]]
-                isNotOK = (NV0 < NV)
+            hedge = np.zeros(cellLocation[-1], dtype=self.itype)
+            start = self.he_n[self.cell2hedge[:-1]] # 下一个边
+            walk_cells(self.he_n, start, cellLocation, hedge)
+            cell2edge = J[hedge]
             return cell2edge
 
     def cell_to_face(self, sparse=True):
@@ -671,42 +705,71 @@ class HalfEdgePolygonMeshDataStructure():
         return node2cell
 
 
+    def boundary_flags(self):
+        """
+
+        Notes
+        -----
+            只遍历一次边界半边, 同时得到边界节点, 边和单元的标记
+            (isBdNode, isBdEdge, isBdCell).
+        """
+        if 'flags' not in self._bd_cache:
+            bd = self.bd_halfedges
+            twin = self.he_o[bd]
+
+            # 边界半边的对偶半边所在的单元就是边界单元
+            isBdCell = np.zeros(self.NC, dtype=np.bool_)
+            isBdCell[self.he_c[twin]] = True
+
+            # 边按主半边的顺序编号, 对偶半边是边界半边的主半边对应边界边,
+            # 边界边的两个端点是边界节点
+            isMainHEdge = (self.he_m == 1)
+            eidx = np.cumsum(isMainHEdge) - 1
+            flag = isMainHEdge[twin]
+            isBdEdge = np.zeros(self.NE, dtype=np.bool_)
+            isBdEdge[eidx[twin[flag]]] = True
+
+            isBdNode = np.zeros(self.NN, dtype=np.bool_)
+            isBdNode[self.he_v[bd[flag]]] = True
+            isBdNode[self.he_v[twin[flag]]] = True
+            for flag in (isBdNode, isBdEdge, isBdCell):
+                flag.setflags(write=False)
+            self._bd_cache['flags'] = (isBdNode, isBdEdge, isBdCell)
+        return self._bd_cache['flags']
+
     def boundary_node_flag(self):
-        NN = self.NN
-        edge = self.edge_to_node()
-        isBdEdge = self.boundary_edge_flag()
-        isBdNode = np.zeros(NN, dtype=np.bool_)
-        isBdNode[edge[isBdEdge,:]] = True
-        return isBdNode
+        return self.boundary_flags()[0]
 
     def boundary_edge_flag(self):
-        NE = self.NE
-        edge2cell = self.edge_to_cell()
-        return edge2cell[:, 0] == edge2cell[:, 1]
+        return self.boundary_flags()[1]
 
     def boundary_edge(self):
         edge = self.edge_to_node()
         return edge[self.boundary_edge_index()]
 
     def boundary_cell_flag(self):
-        NC = self.NC
-        edge2cell = self.edge_to_cell()
-        isBdEdge = edge2cell[:, 0] == edge2cell[:, 1]
-        isBdCell = np.zeros(NC, dtype=np.bool_)
-        isBdCell[edge2cell[isBdEdge, 0:2]] = True
-        return isBdCell
+        return self.boundary_flags()[2]
 
     def boundary_node_index(self):
-        isBdNode = self.boundary_node_flag()
-        idx, = np.nonzero(isBdNode)
-        return idx
+        if 'node_index' not in self._bd_cache:
+            isBdNode = self.boundary_node_flag()
+            index = np.flatnonzero(isBdNode)
+            index.setflags(write=False)
+            self._bd_cache['node_index'] = index
+        return self._bd_cache['node_index']
 
     def boundary_edge_index(self):
-        isBdEdge = self.boundary_edge_flag()
-        idx, = np.nonzero(isBdEdge)
-        return idx
+        if 'edge_index' not in self._bd_cache:
+            isBdEdge = self.boundary_edge_flag()
+            index = np.flatnonzero(isBdEdge)
+            index.setflags(write=False)
+            self._bd_cache['edge_index'] = index
+        return self._bd_cache['edge_index']
 
     def boundary_cell_index(self):
-        isBdCell = self.boundary_cell_flag()
-        idx, = np.nonzero(isBdCell)
-        return idx
+        if 'cell_index' not in self._bd_cache:
+            isBdCell = self.boundary_cell_flag()
+            index = np.flatnonzero(isBdCell)
+            index.setflags(write=False)
+            self._bd_cache['cell_index'] = index
+        return self._bd_cache['cell_index']
@@ -0,0 +1,26 @@
+try:
+    from numba import njit, prange
+except ImportError:
+    # 没有安装 numba 时, 下面的核函数退化为普通的 Python 函数
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda f: f
+    prange = range
+
+
+@njit(parallel=True, cache=True)
+def walk_cells(nex, start, cellLocation, out):
+    """
+
+    Notes
+    -----
+    从每个单元的起始半边 start[c] 出发, 沿着下一条半边 nex 走一圈, 把单元 c
+    的半边编号依次写入 out[cellLocation[c]:cellLocation[c+1]].
+    """
+    NC = len(start)
+    for c in prange(NC):
+        h = start[c]
+        for k in range(cellLocation[c], cellLocation[c+1]):
+            out[k] = h
+            h = nex[h]
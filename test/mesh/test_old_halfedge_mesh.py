@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from fealpy.mesh import QuadrangleMesh
+from fealpy.mesh.backup.old.HalfEdgeMesh import HalfEdgeMesh
+
+
+def test_refine_poly_data_without_new_edge():
+    """
+    中心单元的每条边上都已经有悬挂点, 加密它时不会再细分边 (NE1 == 0),
+    节点上的数据仍然要正确插值.
+    """
+    mesh = QuadrangleMesh.from_box([0, 1, 0, 1], nx=3, ny=3)
+    mesh = HalfEdgeMesh.from_mesh(mesh)
+
+    idx = [i for i in range(9) if i != 4]
+    mesh.refine_poly(mesh.mark_helper(idx), options={'disp': True, 'data': None})
+
+    # 没有加密的单元排在最前面, 中心单元现在的编号是 0
+    data = {'u': mesh.node[:, 0].copy()}
+    mesh.refine_poly(mesh.mark_helper([0]), options={'disp': True, 'data': data})
+
+    assert mesh.number_of_cells() == 36
+    assert data['u'].shape == (mesh.number_of_nodes(), )
+    assert np.allclose(data['u'], mesh.node[:, 0])
+
+
+def test_refine_poly_batch():
+    """
+    分组批量加密和逐组调用 refine_poly 得到的网格相同. 有的组和前面还没有
+    加密的组相邻, 必须分开加密, 其余的组合并到一次 refine_poly 调用中.
+    """
+    idx = [[0], [15], [1], [10], [5, 12]]
+
+    mesh0 = HalfEdgeMesh.from_mesh(QuadrangleMesh.from_box([0, 1, 0, 1], nx=4, ny=4))
+    # 原来的单元在当前网格中的编号, 没有加密的单元按原来的顺序排在前面
+    cidxmap = np.arange(mesh0.number_of_all_cells())
+    for i in idx:
+        flag = mesh0.mark_helper([])
+        flag[cidxmap[mesh0.ds.cellstart + np.array(i)]] = True
+        mesh0.refine_poly(flag, options={'disp': True, 'data': None})
+        cidxmap = (np.cumsum(~flag) - 1)[cidxmap]
+
+    mesh1 = HalfEdgeMesh.from_mesh(QuadrangleMesh.from_box([0, 1, 0, 1], nx=4, ny=4))
+    ncall = [0]
+    refine_poly = mesh1.refine_poly
+    def counter(*args, **kwargs):
+        ncall[0] += 1
+        return refine_poly(*args, **kwargs)
+    mesh1.refine_poly = counter
+    mesh1.refine_poly_batch([mesh1.mark_helper(i) for i in idx],
+            options={'disp': True, 'data': None})
+
+    assert 1 < ncall[0] < len(idx)
+    assert mesh1.number_of_cells() == mesh0.number_of_cells()
+    assert mesh1.number_of_nodes() == mesh0.number_of_nodes()
+    node0 = mesh0.node[np.lexsort(mesh0.node.T)]
+    node1 = mesh1.node[np.lexsort(mesh1.node.T)]
+    assert np.allclose(node0, node1)
+    assert np.allclose(np.sort(mesh0.cell_area()), np.sort(mesh1.cell_area()))
+
+
+def test_refine_poly_batch_refined_cell():
+    """
+    后面的标记不能再标记已经加密过的单元
+    """
+    mesh = HalfEdgeMesh.from_mesh(QuadrangleMesh.from_box([0, 1, 0, 1], nx=4, ny=4))
+    markedCells = [mesh.mark_helper([0]), mesh.mark_helper([1]), mesh.mark_helper([0])]
+    with pytest.raises(AssertionError):
+        mesh.refine_poly_batch(markedCells, options={'disp': True, 'data': None})
+
+
+def test_halfedges_of_node():
+    """
+    加密前后 halfedges_of_node 都要给出从节点出发的所有半边
+    """
+    mesh = HalfEdgeMesh.from_mesh(QuadrangleMesh.from_box([0, 1, 0, 1], nx=3, ny=3))
+    for k in range(2):
+        ds = mesh.ds
+        he_s = ds.he_v[ds.he_p]
+        for i in range(mesh.number_of_nodes()):
+            assert np.array_equal(ds.halfedges_of_node(i), np.flatnonzero(he_s == i))
+        mesh.refine_poly(mesh.mark_helper([0, 4]), options={'disp': True, 'data': None})